@@ -0,0 +1,342 @@
+# api.py
+"""API HTTP (ASGI) du moteur d'impacts.
+
+Lancement : uvicorn api:app --host 0.0.0.0 --port 8000
+
+Les projets sont gardés en mémoire du processus : lancer un seul worker
+uvicorn, le parallélisme du rendu est assuré par le pool de processus.
+"""
+import asyncio
+import contextlib
+import os
+import uuid
+from collections import Counter, OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+
+from starlette.applications import Starlette
+from starlette.responses import HTMLResponse, JSONResponse, Response
+from starlette.routing import Route
+
+from exports import exporter_csv
+from leopold import (
+    COMPOSANTES, DUREES, ETENDUES, INTENSITES, NATURES, PHASES,
+    Activity, Impact, Phase, Project, tableau_html_fusion,
+)
+from utils import evaluer_importance
+
+MAX_RENDUS = 256
+
+projets = {}
+# (id projet, version, format) -> tâche partagée par les requêtes concurrentes
+_rendus = OrderedDict()
+_pool = None
+
+
+class EtatProjet:
+    """Projet et numéro de version, incrémenté à chaque écriture.
+
+    Le verrou sérialise les écritures avec la construction du DataFrame, qui
+    s'exécute hors de la boucle d'événements.
+    """
+
+    def __init__(self, project):
+        self.project = project
+        self.version = 0
+        self.verrou = asyncio.Lock()
+
+
+class ErreurRequete(Exception):
+    def __init__(self, message, status_code=400):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+def _rendre_html(df):
+    return tableau_html_fusion(df)
+
+
+def _rendre_csv(df):
+    return exporter_csv(df)
+
+
+RENDUS = {
+    "html": (_rendre_html, "text/html; charset=utf-8"),
+    "csv": (_rendre_csv, "text/csv; charset=utf-8"),
+}
+
+
+# --- Sérialisation -----------------------------------------------------------
+
+def _champ(donnees, nom, valeurs=None, obligatoire=True):
+    valeur = donnees.get(nom)
+    if valeur in (None, ""):
+        if obligatoire:
+            raise ErreurRequete(f"Champ obligatoire manquant : {nom}")
+        return None
+    if not isinstance(valeur, str):
+        raise ErreurRequete(f"Le champ {nom} doit être une chaîne")
+    if valeurs is None:
+        return valeur
+    # Comparaison insensible à la casse, on renvoie la valeur canonique
+    for canonique in valeurs:
+        if canonique.lower() == valeur.lower():
+            return canonique
+    raise ErreurRequete(f"Valeur invalide pour {nom} : {valeur!r} (attendu : {', '.join(valeurs)})")
+
+
+def _impact_json(impact):
+    return {
+        "composante": impact.composante,
+        "milieu": impact.milieu,
+        "nature": impact.nature,
+        "impact_apprehende": impact.impact_apprehende,
+        "intensite": impact.intensite,
+        "etendue": impact.etendue,
+        "duree": impact.duree,
+        "attenuation": impact.attenuation,
+        "importance": impact.importance,
+    }
+
+
+def _projet_json(id_projet, project):
+    return {
+        "id": id_projet,
+        "phases": [
+            {
+                "nom": phase.name,
+                "activites": [
+                    {"nom": activity.name, "impacts": [_impact_json(imp) for imp in activity.impacts]}
+                    for activity in phase.activities
+                ],
+            }
+            for phase in project.phases
+        ],
+    }
+
+
+def _appliquer_structure(project, donnees):
+    """Remplace les phases/activités du projet en conservant les impacts des activités gardées."""
+    phases = donnees.get("phases", [])
+    if not isinstance(phases, list):
+        raise ErreurRequete("Le champ phases doit être une liste")
+    structure = []
+    for entree in phases:
+        if not isinstance(entree, dict):
+            raise ErreurRequete("Chaque phase doit être un objet")
+        nom = _champ(entree, "nom", PHASES)
+        if any(nom == deja for deja, _ in structure):
+            raise ErreurRequete(f"Phase en double : {nom}")
+        activites = entree.get("activites", [])
+        if not isinstance(activites, list) or not all(isinstance(a, str) and a for a in activites):
+            raise ErreurRequete(f"Phase {nom} : activites doit être une liste de noms")
+        doublons = sorted(a for a, n in Counter(activites).items() if n > 1)
+        if doublons:
+            raise ErreurRequete(f"Phase {nom} : activités en double : {', '.join(doublons)}")
+        structure.append((nom, activites))
+
+    anciennes = {phase.name: phase for phase in project.phases}
+    project.phases = []
+    for nom, activites in structure:
+        phase = anciennes.get(nom) or Phase(nom)
+        existantes = {activity.name: activity for activity in phase.activities}
+        phase.activities = [existantes.get(nom_act) or Activity(nom_act) for nom_act in activites]
+        project.phases.append(phase)
+
+
+def _construire_impact(donnees):
+    if not isinstance(donnees, dict):
+        raise ErreurRequete("Chaque impact doit être un objet")
+    nature = _champ(donnees, "nature", NATURES)
+    risque = nature == "risque impact"
+    impact = Impact(
+        _champ(donnees, "composante", COMPOSANTES),
+        _champ(donnees, "milieu").strip(),
+        nature,
+        _champ(donnees, "impact_apprehende", obligatoire=False) or "",
+        None if risque else _champ(donnees, "intensite", INTENSITES),
+        None if risque else _champ(donnees, "etendue", ETENDUES),
+        None if risque else _champ(donnees, "duree", DUREES),
+        # Comme l'éditeur : chaîne vide plutôt que None pour une mesure non renseignée
+        (_champ(donnees, "attenuation", obligatoire=False) or "") if nature in ("négatif", "risque impact") else None,
+    )
+    return _champ(donnees, "phase", PHASES), _champ(donnees, "activite"), impact
+
+
+def _upsert_impact(project, nom_phase, nom_activite, impact):
+    project.add_phase(nom_phase)
+    phase = project.get_phase(nom_phase)
+    activity = next((a for a in phase.activities if a.name == nom_activite), None)
+    if activity is None:
+        activity = Activity(nom_activite)
+        phase.activities.append(activity)
+
+    # Même clé que l'éditeur : un impact par (composante, milieu) et par activité
+    for idx, existant in enumerate(activity.impacts):
+        if existant.composante == impact.composante and existant.milieu == impact.milieu:
+            activity.impacts[idx] = impact
+            return False
+    activity.impacts.append(impact)
+    return True
+
+
+# --- Points d'entrée ---------------------------------------------------------
+
+async def _corps_json(request):
+    try:
+        return await request.json()
+    except ValueError:
+        raise ErreurRequete("Corps JSON invalide")
+
+
+def _projet(request):
+    id_projet = request.path_params["id_projet"]
+    etat = projets.get(id_projet)
+    if etat is None:
+        raise ErreurRequete(f"Projet introuvable : {id_projet}", 404)
+    return id_projet, etat
+
+
+async def creer_projet(request):
+    donnees = await _corps_json(request) if await request.body() else {}
+    if not isinstance(donnees, dict):
+        raise ErreurRequete("Le corps doit être un objet")
+    project = Project()
+    _appliquer_structure(project, donnees)
+    id_projet = uuid.uuid4().hex
+    projets[id_projet] = EtatProjet(project)
+    return JSONResponse(_projet_json(id_projet, project), status_code=201)
+
+
+async def lire_projet(request):
+    id_projet, etat = _projet(request)
+    return JSONResponse(_projet_json(id_projet, etat.project))
+
+
+async def modifier_projet(request):
+    id_projet, etat = _projet(request)
+    donnees = await _corps_json(request)
+    if not isinstance(donnees, dict):
+        raise ErreurRequete("Le corps doit être un objet")
+    async with etat.verrou:
+        _appliquer_structure(etat.project, donnees)
+        etat.version += 1
+    return JSONResponse(_projet_json(id_projet, etat.project))
+
+
+async def supprimer_projet(request):
+    id_projet, _ = _projet(request)
+    del projets[id_projet]
+    for cle in [cle for cle in _rendus if cle[0] == id_projet]:
+        del _rendus[cle]
+    return Response(status_code=204)
+
+
+async def upsert_impacts(request):
+    _, etat = _projet(request)
+    donnees = await _corps_json(request)
+    impacts = donnees.get("impacts") if isinstance(donnees, dict) else donnees
+    if not isinstance(impacts, list):
+        raise ErreurRequete("Le corps doit contenir une liste d'impacts")
+    # Tout le lot est validé avant la première écriture
+    lot = []
+    for position, entree in enumerate(impacts):
+        try:
+            lot.append(_construire_impact(entree))
+        except ErreurRequete as exc:
+            raise ErreurRequete(f"Impact {position} : {exc}")
+    async with etat.verrou:
+        crees = sum(_upsert_impact(etat.project, *element) for element in lot)
+        etat.version += 1
+    return JSONResponse({"crees": crees, "mis_a_jour": len(impacts) - crees})
+
+
+async def importance(request):
+    donnees = await _corps_json(request)
+    lot = donnees if isinstance(donnees, list) else [donnees]
+    if not all(isinstance(d, dict) for d in lot):
+        raise ErreurRequete("Chaque évaluation doit être un objet")
+    resultats = [
+        evaluer_importance(
+            _champ(d, "intensite", INTENSITES), _champ(d, "etendue", ETENDUES), _champ(d, "duree", DUREES)
+        )
+        for d in lot
+    ]
+    if isinstance(donnees, list):
+        return JSONResponse({"importances": resultats})
+    return JSONResponse({"importance": resultats[0]})
+
+
+async def _rendre(etat, fonction):
+    boucle = asyncio.get_running_loop()
+    # Construction du DataFrame dans un thread, rendu CPU dans le pool de processus
+    async with etat.verrou:
+        df = await boucle.run_in_executor(None, etat.project.to_dataframe)
+    if df.empty:
+        return None
+    return await boucle.run_in_executor(_pool, fonction, df)
+
+
+async def matrice(request):
+    id_projet, etat = _projet(request)
+    fmt = request.path_params["format"]
+    if fmt not in RENDUS:
+        raise ErreurRequete(f"Format inconnu : {fmt}", 404)
+
+    fonction, media_type = RENDUS[fmt]
+    # La version suffit comme clé : un accès au cache ne parcourt ni le projet ni le DataFrame
+    cle = (id_projet, etat.version, fmt)
+    rendu = _rendus.get(cle)
+    if rendu is None:
+        # Les requêtes identiques attendent le même rendu
+        rendu = asyncio.ensure_future(_rendre(etat, fonction))
+        _rendus[cle] = rendu
+        while len(_rendus) > MAX_RENDUS:
+            _rendus.popitem(last=False)
+    else:
+        _rendus.move_to_end(cle)
+    try:
+        contenu = await asyncio.shield(rendu)
+    except Exception:
+        _rendus.pop(cle, None)
+        raise
+    if contenu is None:
+        return Response(status_code=204)
+    if fmt == "html":
+        return HTMLResponse(contenu)
+    return Response(contenu, media_type=media_type,
+                    headers={"Content-Disposition": 'attachment; filename="matrice_impacts.csv"'})
+
+
+async def _erreur_requete(request, exc):
+    return JSONResponse({"erreur": str(exc)}, status_code=exc.status_code)
+
+
+@contextlib.asynccontextmanager
+async def lifespan(app):
+    global _pool
+    _pool = ProcessPoolExecutor(max_workers=int(os.environ.get("MATRICE_WORKERS", os.cpu_count() or 1)))
+    try:
+        yield
+    finally:
+        _pool.shutdown(cancel_futures=True)
+        _pool = None
+
+
+app = Starlette(
+    routes=[
+        Route("/projets", creer_projet, methods=["POST"]),
+        Route("/projets/{id_projet}", lire_projet, methods=["GET"]),
+        Route("/projets/{id_projet}", modifier_projet, methods=["PUT"]),
+        Route("/projets/{id_projet}", supprimer_projet, methods=["DELETE"]),
+        Route("/projets/{id_projet}/impacts", upsert_impacts, methods=["POST"]),
+        Route("/projets/{id_projet}/matrice.{format}", matrice, methods=["GET"]),
+        Route("/importance", importance, methods=["POST"]),
+    ],
+    exception_handlers={ErreurRequete: _erreur_requete},
+    lifespan=lifespan,
+)
+
+
+if __name__ == "__main__":
+    import uvicorn
+    uvicorn.run("api:app", host="0.0.0.0", port=int(os.environ.get("PORT", 8000)))
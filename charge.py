@@ -0,0 +1,251 @@
+# charge.py
+"""Test de charge local de l'application Streamlit (leopold.py).
+
+Chaque session simulée rejoue un scénario d'édition (phase, activités,
+composantes, milieux, descriptions) avec streamlit.testing.v1.AppTest, sur un
+projet qui grossit par paliers. AppTest n'est pas prévu pour tourner dans
+plusieurs threads d'un même processus : chaque session a donc son propre
+processus, lancé en même temps que les autres. Le CPU et la mémoire sont
+mesurés par session.
+
+Limite : les sessions se disputent les cœurs de la machine, mais pas le GIL,
+le pool d'exports ni les caches partagés d'un vrai serveur `streamlit run`,
+qui sert toutes les sessions dans un seul processus. Les latences mesurées
+sont donc un minorant de celles d'un serveur chargé du même nombre de
+sessions.
+
+Un niveau dont une session échoue (exception du script ou du processus) est
+marqué invalide, et le programme se termine avec un code non nul. Les
+percentiles et les chiffres par session ne portent que sur les sessions
+réussies.
+
+Exemple : python charge.py --sessions 1 4 16 --activites 2 8 32 --sortie rapport_charge.json
+"""
+import argparse
+import json
+import math
+import multiprocessing
+import os
+import queue
+import resource
+import sys
+import threading
+import time
+
+PHASE = "Construction"
+COMPOSANTES_SCENARIO = ["Physique", "Biologique"]
+# Délai d'attente des autres sessions au départ (import de streamlit compris)
+DELAI_DEPART = 120
+
+
+def percentile(valeurs, p):
+    """Percentile au rang le plus proche (valeurs non vides)."""
+    triees = sorted(valeurs)
+    return triees[max(0, math.ceil(p / 100 * len(triees)) - 1)]
+
+
+def _rss_max_mio():
+    # ru_maxrss est en kio sous Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def _cpu_secondes():
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return usage.ru_utime + usage.ru_stime
+
+
+def _scenario(numero, script, paliers, repetitions, timeout, mesures, erreurs):
+    from streamlit.testing.v1 import AppTest
+
+    palier_courant = 0
+
+    def rerun(element, etape):
+        debut = time.perf_counter()
+        at = element.run(timeout=timeout)
+        mesures.append((palier_courant, etape, time.perf_counter() - debut))
+        if at.exception:
+            erreurs.append(f"{etape} : {at.exception[0].message}")
+
+    at = AppTest.from_file(script, default_timeout=timeout)
+    rerun(at, "chargement")
+    rerun(at.multiselect[0].set_value([PHASE]), "phase")
+
+    nb_activites = 0
+    for palier in paliers:
+        palier_courant = palier
+        while nb_activites < palier:
+            nom = f"Activité {numero}-{nb_activites}"
+            rerun(at.text_input(key=f"new_act_{PHASE}").input(nom), "activite")
+            rerun(at.button(key=f"add_act_{PHASE}").click(), "activite")
+            rerun(at.multiselect(key=f"comp_{PHASE}_{nom}").set_value(COMPOSANTES_SCENARIO), "composante")
+            for comp in COMPOSANTES_SCENARIO:
+                comp_key = f"comp_{PHASE}_{nom}_{comp}"
+                milieu_key = f"{comp_key}_milieu_1"
+                rerun(at.button(key=f"add_mil_{comp_key}").click(), "milieu")
+                rerun(at.text_input(key=f"name_{milieu_key}").input("Eau"), "milieu")
+                rerun(at.text_area(key=f"desc_{milieu_key}").input(f"Impact de {nom} sur {comp}"), "description")
+            nb_activites += 1
+
+        if not nb_activites:
+            continue
+        # Reruns à taille constante : coût d'une simple édition sur ce palier
+        dernier = f"comp_{PHASE}_Activité {numero}-{nb_activites - 1}_{COMPOSANTES_SCENARIO[0]}_milieu_1"
+        for r in range(repetitions):
+            rerun(at.text_area(key=f"desc_{dernier}").input(f"Description révisée {r}"), "stable")
+
+
+def _session(numero, script, paliers, repetitions, timeout, depart, resultats):
+    """Exécuté dans un processus neuf : une session, du départ commun à la fin du scénario."""
+    mesures = []
+    erreurs = []
+    # Import de streamlit et de pandas avant la mesure de référence
+    import pandas  # noqa: F401
+    from streamlit.testing.v1 import AppTest  # noqa: F401
+
+    rss_base = _rss_max_mio()
+    try:
+        depart.wait(DELAI_DEPART)
+    except threading.BrokenBarrierError:
+        erreurs.append("départ : une autre session n'a pas démarré")
+    cpu_debut = _cpu_secondes()
+    if not erreurs:
+        try:
+            _scenario(numero, script, paliers, repetitions, timeout, mesures, erreurs)
+        except Exception as exc:
+            erreurs.append(f"session : {exc!r}")
+    resultats.put({
+        "session": numero,
+        "mesures": mesures,
+        "erreurs": erreurs,
+        "cpu_s": _cpu_secondes() - cpu_debut,
+        "rss_base_mio": rss_base,
+        "rss_max_mio": _rss_max_mio(),
+    })
+
+
+def _statistiques(latences):
+    if not latences:
+        return None
+    return {
+        "n": len(latences),
+        "p50_ms": percentile(latences, 50) * 1000,
+        "p95_ms": percentile(latences, 95) * 1000,
+        "p99_ms": percentile(latences, 99) * 1000,
+        "max_ms": max(latences) * 1000,
+    }
+
+
+def _collecter(processus, resultats):
+    # Lecture avant join : un processus ne se termine qu'une fois son résultat consommé
+    recus = {}
+    while len(recus) < len(processus):
+        try:
+            session = resultats.get(timeout=0.5)
+        except queue.Empty:
+            if not any(p.is_alive() for p in processus):
+                break
+            continue
+        recus[session["session"]] = session
+    for p in processus:
+        p.join()
+    # Processus mort sans résultat (signal, mémoire épuisée…)
+    for numero, p in enumerate(processus):
+        if numero not in recus:
+            recus[numero] = {"session": numero, "mesures": [], "cpu_s": 0.0, "rss_base_mio": 0.0,
+                             "rss_max_mio": 0.0, "erreurs": [f"processus : code de sortie {p.exitcode}"]}
+    return [recus[numero] for numero in range(len(processus))]
+
+
+def executer_niveau(script, nb_sessions, paliers, repetitions, timeout):
+    contexte = multiprocessing.get_context("spawn")
+    depart = contexte.Barrier(nb_sessions)
+    resultats = contexte.Queue()
+    processus = [
+        contexte.Process(target=_session, name=f"session-{n}",
+                         args=(n, script, paliers, repetitions, timeout, depart, resultats))
+        for n in range(nb_sessions)
+    ]
+    debut = time.perf_counter()
+    for p in processus:
+        p.start()
+    sessions = _collecter(processus, resultats)
+    duree = time.perf_counter() - debut
+
+    # Une session en erreur n'a pas joué tout le scénario : elle fausserait les chiffres par session
+    reussies = [s for s in sessions if not s["erreurs"]]
+    niveau = {
+        "sessions": nb_sessions,
+        "sessions_reussies": len(reussies),
+        "valide": len(reussies) == nb_sessions,
+        "duree_s": duree,
+        "cpu_total_s": sum(s["cpu_s"] for s in sessions),
+        "utilisation_cpu": sum(s["cpu_s"] for s in sessions) / (duree * (os.cpu_count() or 1)),
+        "cpu_par_session_s": None,
+        "rss_max_par_session_mio": None,
+        "rss_session_mio": None,
+        "erreurs": [f"session {s['session']} — {e}" for s in sessions for e in s["erreurs"]],
+        "global": _statistiques([lat for s in reussies for _, _, lat in s["mesures"]]),
+        "par_palier": {},
+    }
+    if reussies:
+        niveau["cpu_par_session_s"] = sum(s["cpu_s"] for s in reussies) / len(reussies)
+        niveau["rss_max_par_session_mio"] = max(s["rss_max_mio"] for s in reussies)
+        # Mémoire propre à la session, au-delà de l'import de streamlit
+        niveau["rss_session_mio"] = max(s["rss_max_mio"] - s["rss_base_mio"] for s in reussies)
+    for palier in paliers:
+        niveau["par_palier"][palier] = _statistiques(
+            [lat for s in reussies for p, etape, lat in s["mesures"] if p == palier and etape == "stable"]
+        )
+    return niveau
+
+
+def afficher_rapport(rapport):
+    print(f"Script : {rapport['script']} — {rapport['cpu']} cœurs")
+    entete = f"{'sessions':>8} {'activités':>9} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'CPU/sess s':>10} {'RSS/sess Mio':>12} {'dont session':>12}"
+    print(entete)
+    print("-" * len(entete))
+    for niveau in rapport["niveaux"]:
+        if not niveau["valide"]:
+            print(f"{niveau['sessions']:>8} NIVEAU INVALIDE : {niveau['sessions_reussies']}/{niveau['sessions']} "
+                  f"session(s) réussie(s), chiffres partiels")
+        for palier, stats in niveau["par_palier"].items():
+            if stats is None:
+                continue
+            print(f"{niveau['sessions']:>8} {palier:>9} {stats['p50_ms']:>8.0f} {stats['p95_ms']:>8.0f} "
+                  f"{stats['p99_ms']:>8.0f} {niveau['cpu_par_session_s']:>10.1f} {niveau['rss_max_par_session_mio']:>12.0f} "
+                  f"{niveau['rss_session_mio']:>12.0f}")
+        if niveau["erreurs"]:
+            print(f"  {len(niveau['erreurs'])} erreur(s), ex. : {niveau['erreurs'][0]}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Test de charge local de la matrice d'impacts")
+    parser.add_argument("--script", default=os.path.join(os.path.dirname(os.path.abspath(__file__)), "leopold.py"))
+    parser.add_argument("--sessions", type=int, nargs="+", default=[1, 4, 8],
+                        help="niveaux de concurrence à tester")
+    parser.add_argument("--activites", type=int, nargs="+", default=[2, 8, 32],
+                        help="paliers de taille du projet (nombre d'activités)")
+    parser.add_argument("--repetitions", type=int, default=20,
+                        help="reruns d'édition mesurés sur chaque palier")
+    parser.add_argument("--timeout", type=float, default=60, help="délai maximal d'un rerun (s)")
+    parser.add_argument("--sortie", default="rapport_charge.json")
+    args = parser.parse_args()
+
+    paliers = sorted(set(args.activites))
+    rapport = {"script": args.script, "cpu": os.cpu_count(), "paliers": paliers, "niveaux": []}
+    for nb_sessions in args.sessions:
+        print(f"… {nb_sessions} session(s) concurrente(s)")
+        rapport["niveaux"].append(executer_niveau(args.script, nb_sessions, paliers, args.repetitions, args.timeout))
+    rapport["valide"] = all(niveau["valide"] for niveau in rapport["niveaux"])
+
+    with open(args.sortie, "w", encoding="utf-8") as f:
+        json.dump(rapport, f, ensure_ascii=False, indent=2)
+    afficher_rapport(rapport)
+    print(f"Rapport détaillé : {args.sortie}")
+    if not rapport["valide"]:
+        print("Échec : au moins un niveau est invalide, voir les erreurs ci-dessus", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,136 @@
+# exports.py
+import hashlib
+import io
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+
+import pandas as pd
+
+
+def exporter_csv(df):
+    return df.to_csv(index=False, sep=';').encode('utf-8')
+
+
+def exporter_excel(df):
+    tampon = io.BytesIO()
+    with pd.ExcelWriter(tampon, engine="openpyxl") as writer:
+        df.to_excel(writer, index=False, sheet_name="Matrice")
+    return tampon.getvalue()
+
+
+def exporter_parquet(df):
+    tampon = io.BytesIO()
+    df.to_parquet(tampon, index=False)
+    return tampon.getvalue()
+
+
+def page_html(tableau):
+    page = f'<html><head><meta charset="utf-8"></head><body>{tableau}</body></html>'
+    return page.encode('utf-8')
+
+
+def exporter_html(df):
+    # Import local : leopold importe lui-même ce module
+    from leopold import tableau_html_fusion
+    return page_html(tableau_html_fusion(df))
+
+
+# format -> (libellé, fonction d'export, nom de fichier, type MIME, dépendance optionnelle)
+FORMATS = {
+    "csv": ("💾 Exporter en CSV", exporter_csv, "matrice_impacts.csv", "text/csv", None),
+    "xlsx": ("📗 Exporter en Excel", exporter_excel, "matrice_impacts.xlsx",
+             "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet", "openpyxl"),
+    "parquet": ("🗃️ Exporter en Parquet", exporter_parquet, "matrice_impacts.parquet",
+                "application/vnd.apache.parquet", "pyarrow"),
+    "html": ("🖨️ Exporter en HTML (impression PDF)", exporter_html, "matrice_impacts.html", "text/html", None),
+}
+
+# Formats construits à chaque version de la matrice ; les autres, coûteux en CPU
+# pur Python, ne sont construits qu'à la demande
+FORMATS_IMMEDIATS = ("csv",)
+
+
+def formats_disponibles():
+    """Formats dont la dépendance optionnelle est installée."""
+    disponibles = []
+    for fmt, (_, _, _, _, dependance) in FORMATS.items():
+        if dependance is not None:
+            try:
+                __import__(dependance)
+            except ImportError:
+                continue
+        disponibles.append(fmt)
+    return disponibles
+
+
+def signature(df):
+    """Empreinte du contenu de la matrice, utilisée comme clé des artefacts."""
+    empreinte = pd.util.hash_pandas_object(df, index=False).values
+    return hashlib.sha1(empreinte.tobytes()).hexdigest()
+
+
+class ExportManager:
+    """Construit les exports en arrière-plan et conserve les artefacts terminés.
+
+    Les jobs sont indexés par (signature de la matrice, format) : une matrice
+    inchangée entre deux reruns réutilise les mêmes artefacts. Un gestionnaire
+    par session, l'exécuteur pouvant être partagé entre sessions.
+    """
+
+    def __init__(self, executor=None, max_workers=4, max_versions=4):
+        self._executor = executor or ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="export")
+        self._jobs = {}
+        self._versions = []
+        self._max_versions = max_versions
+        self._lock = threading.Lock()
+
+    def soumettre(self, df, formats=FORMATS_IMMEDIATS, cle=None):
+        """Soumet les formats demandés au pool et retourne la signature de la matrice."""
+        cle = cle or signature(df)
+        with self._lock:
+            if cle in self._versions:
+                self._versions.remove(cle)
+            self._versions.append(cle)
+            for fmt in formats:
+                job = self._jobs.get((cle, fmt))
+                # Soumet les jobs manquants ou annulés
+                if job is None or job.cancelled():
+                    self._jobs[(cle, fmt)] = self._executor.submit(FORMATS[fmt][1], df.copy())
+            self._purger()
+        return cle
+
+    def _purger(self):
+        # Ne garde que les artefacts des versions les plus récentes
+        anciennes = self._versions[:-self._max_versions]
+        if not anciennes:
+            return
+        del self._versions[:-self._max_versions]
+        for cle, fmt in list(self._jobs):
+            if cle in anciennes:
+                self._jobs.pop((cle, fmt)).cancel()
+
+    def deposer(self, cle, fmt, contenu):
+        """Enregistre un artefact déjà calculé (ex. le tableau HTML affiché par la page)."""
+        job = Future()
+        job.set_result(contenu)
+        with self._lock:
+            if cle in self._versions:
+                self._jobs[(cle, fmt)] = job
+
+    def etat(self, cle):
+        """Retourne {format: future} pour une signature donnée."""
+        with self._lock:
+            return {fmt: job for (c, fmt), job in self._jobs.items() if c == cle}
+
+    def progression(self, cle):
+        jobs = self.etat(cle)
+        if not jobs:
+            return 0.0
+        return sum(job.done() for job in jobs.values()) / len(jobs)
+
+    def artefact(self, cle, fmt):
+        """Contenu de l'export s'il est prêt, sinon None."""
+        job = self.etat(cle).get(fmt)
+        if job is None or not job.done() or job.cancelled() or job.exception() is not None:
+            return None
+        return job.result()
@@ -0,0 +1,41 @@
+# filtres.py
+
+# colonne de la matrice -> libellé du filtre
+COLONNES_FILTRABLES = {
+    "Phase": "Phase",
+    "Composante": "Composante",
+    "Milieu": "Milieu",
+    "Nature impact": "Nature",
+    "Importance": "Importance",
+}
+
+
+def construire_index(df):
+    """Index inversé {colonne: {valeur: positions des lignes}} construit en une passe par colonne."""
+    index = {}
+    for col in COLONNES_FILTRABLES:
+        groupes = df.groupby(col, sort=False, observed=True).indices
+        index[col] = {valeur: frozenset(positions.tolist()) for valeur, positions in groupes.items()}
+    return index
+
+
+def positions_filtrees(index, selections):
+    """Intersection des positions retenues ; None si aucun filtre n'est actif."""
+    resultat = None
+    # Les filtres les plus sélectifs d'abord pour réduire les intersections
+    actifs = [
+        frozenset().union(*(index[col].get(valeur, frozenset()) for valeur in valeurs))
+        for col, valeurs in selections.items() if valeurs
+    ]
+    for positions in sorted(actifs, key=len):
+        resultat = positions if resultat is None else resultat & positions
+        if not resultat:
+            break
+    return resultat
+
+
+def filtrer(df, index, selections):
+    positions = positions_filtrees(index, selections)
+    if positions is None:
+        return df
+    return df.iloc[sorted(positions)]
@@ -0,0 +1,125 @@
+# historique.py
+from collections import deque
+
+
+def cles_widgets_activite(etat, nom_phase, nom_activite, composantes):
+    """Clés des widgets structurels d'une activité (sélection des composantes et noms des milieux)."""
+    cle = f"comp_{nom_phase}_{nom_activite}"
+    cles = [cle]
+    for comp in composantes:
+        comp_key = f"{cle}_{comp}"
+        nb_milieux = etat.get("milieu_count", {}).get(comp_key, 0)
+        cles.extend(f"name_{comp_key}_milieu_{i}" for i in range(1, nb_milieux + 1))
+    return cles
+
+
+class SuppressionActivite:
+    """Suppression d'une activité.
+
+    L'opération garde une référence vers l'objet Activity retiré : rien n'est
+    copié, l'annulation le réinsère tel quel à sa position.
+    """
+
+    def __init__(self, nom_phase, activity, composantes):
+        self.nom_phase = nom_phase
+        self.activity = activity
+        self.composantes = composantes
+        self.position = None
+        self.widgets = {}
+
+    @property
+    def libelle(self):
+        return f"Suppression de l'activité « {self.activity.name} »"
+
+    def appliquer(self, project, etat):
+        self.position = None
+        phase = project.get_phase(self.nom_phase)
+        if phase is None or self.activity not in phase.activities:
+            return
+        self.position = phase.activities.index(self.activity)
+        phase.activities.pop(self.position)
+        # Les widgets non affichés perdent leur état : on garde ceux qui ne se déduisent pas du modèle
+        cles = cles_widgets_activite(etat, self.nom_phase, self.activity.name, self.composantes)
+        self.widgets = {cle: etat[cle] for cle in cles if cle in etat}
+
+    def annuler(self, project, etat):
+        phase = project.get_phase(self.nom_phase)
+        if phase is None or self.position is None:
+            return
+        phase.activities.insert(min(self.position, len(phase.activities)), self.activity)
+        for cle, valeur in self.widgets.items():
+            etat[cle] = valeur
+
+
+class SuppressionMilieu:
+    """Suppression des impacts d'un milieu pour une composante d'une activité."""
+
+    def __init__(self, activity, composante, milieu, cle_nom):
+        self.activity = activity
+        self.composante = composante
+        self.milieu = milieu
+        self.cle_nom = cle_nom
+        self.retires = []
+
+    @property
+    def libelle(self):
+        return f"Suppression du milieu « {self.milieu} » ({self.activity.name})"
+
+    def appliquer(self, project, etat):
+        self.retires = [
+            (idx, imp) for idx, imp in enumerate(self.activity.impacts)
+            if imp.composante == self.composante and imp.milieu == self.milieu
+        ]
+        for idx, _ in reversed(self.retires):
+            del self.activity.impacts[idx]
+        etat[self.cle_nom] = ""
+
+    def annuler(self, project, etat):
+        for idx, imp in self.retires:
+            self.activity.impacts.insert(idx, imp)
+        etat[self.cle_nom] = self.milieu
+
+
+class Historique:
+    """Journal d'opérations annulables.
+
+    Chaque entrée ne conserve que ce que l'opération a modifié, jamais une
+    copie du projet : le coût mémoire d'une étape est proportionnel à l'édition.
+    """
+
+    def __init__(self, taille_max=100):
+        self._annuler = deque(maxlen=taille_max)
+        self._refaire = []
+
+    @property
+    def peut_annuler(self):
+        return bool(self._annuler)
+
+    @property
+    def peut_refaire(self):
+        return bool(self._refaire)
+
+    def prochaine_annulation(self):
+        return self._annuler[-1].libelle if self._annuler else None
+
+    def prochaine_reprise(self):
+        return self._refaire[-1].libelle if self._refaire else None
+
+    def executer(self, operation, project, etat):
+        operation.appliquer(project, etat)
+        self._annuler.append(operation)
+        self._refaire.clear()
+
+    def annuler(self, project, etat):
+        if not self._annuler:
+            return
+        operation = self._annuler.pop()
+        operation.annuler(project, etat)
+        self._refaire.append(operation)
+
+    def refaire(self, project, etat):
+        if not self._refaire:
+            return
+        operation = self._refaire.pop()
+        operation.appliquer(project, etat)
+        self._annuler.append(operation)
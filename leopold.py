@@ -1,35 +1,107 @@
 import streamlit as st
 import pandas as pd
+import numpy as np
 from utils import evaluer_importance, get_color
+from exports import ExportManager, FORMATS, formats_disponibles, page_html, signature
+from filtres import COLONNES_FILTRABLES, construire_index, filtrer
+from recherche import BibliothequeMesures
+from historique import Historique, SuppressionActivite, SuppressionMilieu
 import html
+import sys
+import uuid
+from concurrent.futures import ThreadPoolExecutor
 
 
 
 
-# Polyfill for Streamlit’s rerun (newer vs older versions)
-try:
-    _rerun = st.experimental_rerun
-except AttributeError:
-    from streamlit.runtime.scriptrunner import RerunException
-    def _rerun():
-        raise RerunException("Rerun requested")
+PHASES = ["Préconstruction", "Construction", "Exploitation/Entretien", "Démantèlement"]
+COMPOSANTES = ["Physique", "Biologique", "Humain"]
+NATURES = ["négatif", "positif", "risque impact"]
+INTENSITES = ["très forte", "forte", "moyenne", "faible"]
+ETENDUES = ["régionale", "locale", "ponctuelle"]
+DUREES = ["long terme", "moyen terme", "court terme"]
+IMPORTANCES = ["Très forte", "Forte", "Moyenne", "Faible", "Très faible", "risque impact"]
+
+# Codes entiers des valeurs énumérées (-1 = non renseigné)
+_CODES = {
+    champ: {valeur: code for code, valeur in enumerate(valeurs)}
+    for champ, valeurs in (
+        ("composante", COMPOSANTES), ("nature", NATURES), ("intensite", INTENSITES),
+        ("etendue", ETENDUES), ("duree", DUREES), ("importance", IMPORTANCES), ("phase", PHASES),
+    )
+}
+
+
+def _coder(champ, valeur):
+    if valeur is None:
+        return -1
+    try:
+        return _CODES[champ][valeur]
+    except KeyError:
+        raise ValueError(f"Valeur invalide pour {champ} : {valeur!r}") from None
+
+
+def _decoder(valeurs, code):
+    return None if code < 0 else valeurs[code]
+
+
+# Évaluations partagées : au plus quelques centaines de combinaisons distinctes
+# (composante, nature, intensité, étendue, durée, importance), une seule instance
+# de tuple par combinaison quel que soit le nombre d'impacts
+_EVALUATIONS = {}
+_COMPOSANTE, _NATURE, _INTENSITE, _ETENDUE, _DUREE, _IMPORTANCE = range(6)
+
+
+def _importance(nature, intensite, etendue, duree):
+    if nature == 'risque impact':
+        return 'risque impact'
+    return evaluer_importance(intensite or '', etendue or '', duree or '')
+
 
 class Impact:
+    # Pas de __dict__ par instance, et un seul pointeur vers l'évaluation partagée
+    __slots__ = ("_evaluation", "milieu", "impact_apprehende", "attenuation")
+
     def __init__(self, composante, milieu, nature, impact_apprehende, intensite=None, etendue=None, duree=None, attenuation=None):
-        self.composante = composante
-        self.milieu = milieu
-        self.nature = nature
+        intensite = intensite.lower() if intensite else None
+        etendue = etendue.lower() if etendue else None
+        duree = duree.lower() if duree else None
+        importance = _importance(nature, intensite, etendue, duree)
+        cle = (
+            _coder("composante", composante), _coder("nature", nature), _coder("intensite", intensite),
+            _coder("etendue", etendue), _coder("duree", duree), _coder("importance", importance),
+        )
+        self._evaluation = _EVALUATIONS.setdefault(cle, cle)
+        self.milieu = sys.intern(milieu)
         self.impact_apprehende = impact_apprehende
-        self.intensite = intensite
-        self.etendue = etendue
-        self.duree = duree
         self.attenuation = attenuation
-        self.importance = self.calculate_importance()
+
+    @property
+    def composante(self):
+        return COMPOSANTES[self._evaluation[_COMPOSANTE]]
+
+    @property
+    def nature(self):
+        return NATURES[self._evaluation[_NATURE]]
+
+    @property
+    def intensite(self):
+        return _decoder(INTENSITES, self._evaluation[_INTENSITE])
+
+    @property
+    def etendue(self):
+        return _decoder(ETENDUES, self._evaluation[_ETENDUE])
+
+    @property
+    def duree(self):
+        return _decoder(DUREES, self._evaluation[_DUREE])
+
+    @property
+    def importance(self):
+        return IMPORTANCES[self._evaluation[_IMPORTANCE]]
 
     def calculate_importance(self):
-        if self.nature == 'risque impact':
-            return 'risque impact'
-        return evaluer_importance(self.intensite or '', self.etendue or '', self.duree or '')
+        return _importance(self.nature, self.intensite, self.etendue, self.duree)
 
 class Activity:
     def __init__(self, name):
@@ -57,24 +129,36 @@ class Project:
 
 
     def to_dataframe(self):
-        data = []
+        colonnes = {
+            "Phase": [], "OrdreActivité": [], "Activité": [], "Composante": [], "Milieu": [],
+            "Nature impact": [], "Importance": [], "Impact appréhendé": [], "Mesure atténuation": [],
+        }
+        avec_attenuation = (_CODES["nature"]['négatif'], _CODES["nature"]['risque impact'])
         for phase in self.phases:
+            code_phase = _coder("phase", phase.name)
             for idx_activite, activity in enumerate(phase.activities):
                 for impact in activity.impacts:
-                    data.append({
-                        "Phase": phase.name,
-                        "OrdreActivité": idx_activite,        
-                        "Activité": activity.name,
-                        "Composante": impact.composante,
-                        "Milieu": impact.milieu,
-                        "Nature impact": impact.nature,
-                        "Importance": impact.importance,
-                        "Impact appréhendé": impact.impact_apprehende,
-                        "Mesure atténuation": impact.attenuation 
-                                        if (impact.nature in ('négatif', 'risque impact')) 
-                                        else ''
-                    })
-        return pd.DataFrame(data)
+                    colonnes["Phase"].append(code_phase)
+                    colonnes["OrdreActivité"].append(idx_activite)
+                    colonnes["Activité"].append(activity.name)
+                    evaluation = impact._evaluation
+                    colonnes["Composante"].append(evaluation[_COMPOSANTE])
+                    colonnes["Milieu"].append(impact.milieu)
+                    colonnes["Nature impact"].append(evaluation[_NATURE])
+                    colonnes["Importance"].append(evaluation[_IMPORTANCE])
+                    colonnes["Impact appréhendé"].append(impact.impact_apprehende)
+                    colonnes["Mesure atténuation"].append(
+                        impact.attenuation if evaluation[_NATURE] in avec_attenuation else ''
+                    )
+
+        # Les colonnes énumérées sont construites directement depuis les codes
+        for colonne, valeurs, ordonnee in (
+            ("Phase", PHASES, True), ("Composante", COMPOSANTES, True),
+            ("Nature impact", NATURES, False), ("Importance", IMPORTANCES, False),
+        ):
+            codes = np.asarray(colonnes[colonne], dtype=np.int8)
+            colonnes[colonne] = pd.Categorical.from_codes(codes, categories=valeurs, ordered=ordonnee)
+        return pd.DataFrame(colonnes)
 
 
 
@@ -86,12 +170,11 @@ def tableau_html_fusion(df):
     ]]
     
     
-    ordre_phases = ["Préconstruction", "Construction", "Exploitation/Entretien", "Démantèlement"]
-    df["Phase"] = pd.Categorical(df["Phase"], categories=ordre_phases, ordered=True)
+    df["Phase"] = pd.Categorical(df["Phase"], categories=PHASES, ordered=True)
 
     df["Composante"] = pd.Categorical(
         df["Composante"],
-        categories=["Physique", "Biologique", "Humain"],
+        categories=COMPOSANTES,
         ordered=True
     )
 
@@ -180,6 +263,153 @@ def tableau_html_fusion(df):
     return html_table
 
 
+def _index_defaut(valeurs, valeur, defaut):
+    return valeurs.index(valeur) if valeur in valeurs else defaut
+
+
+# Callbacks de l'historique : exécutés avant le rerun, ils peuvent modifier l'état des widgets
+def _executer(operation):
+    st.session_state.historique.executer(operation, st.session_state.project, st.session_state)
+
+
+def _annuler():
+    st.session_state.historique.annuler(st.session_state.project, st.session_state)
+
+
+def _refaire():
+    st.session_state.historique.refaire(st.session_state.project, st.session_state)
+
+
+def afficher_historique():
+    historique = st.session_state.historique
+    col1, col2, _ = st.columns([0.12, 0.12, 0.76])
+    with col1:
+        st.button("↩️ Annuler", key="undo", on_click=_annuler,
+                  disabled=not historique.peut_annuler, help=historique.prochaine_annulation())
+    with col2:
+        st.button("↪️ Rétablir", key="redo", on_click=_refaire,
+                  disabled=not historique.peut_refaire, help=historique.prochaine_reprise())
+
+
+@st.cache_resource
+def pool_exports():
+    # Pool partagé par toutes les sessions du serveur
+    return ThreadPoolExecutor(max_workers=4, thread_name_prefix="export")
+
+
+def gestionnaire_exports():
+    # Artefacts propres à la session : les éditions des autres sessions ne les évincent pas
+    if "exports" not in st.session_state:
+        st.session_state.exports = ExportManager(pool_exports())
+    return st.session_state.exports
+
+
+def _preparer_export(df, fmt, cle):
+    gestionnaire_exports().soumettre(df, [fmt], cle=cle)
+
+
+def _boutons_exports(df, cle):
+    manager = gestionnaire_exports()
+    jobs = manager.etat(cle)
+    formats = formats_disponibles()
+    cols = st.columns(len(formats))
+    for col, fmt in zip(cols, formats):
+        libelle, _, nom_fichier, mime, _ = FORMATS[fmt]
+        job = jobs.get(fmt)
+        with col:
+            contenu = manager.artefact(cle, fmt)
+            if contenu is not None:
+                st.download_button(libelle, contenu, nom_fichier, mime, key=f"download-{fmt}")
+            elif job is None or job.cancelled():
+                # Formats lourds : construits seulement si on les demande
+                st.button(f"⚙️ Préparer {fmt.upper()}", key=f"prepare-{fmt}",
+                          on_click=_preparer_export, args=(df, fmt, cle))
+            elif job.done():
+                st.warning(f"Export {fmt} impossible : {job.exception()}")
+            else:
+                st.button(f"⏳ {fmt.upper()} en préparation…", disabled=True, key=f"pending-{fmt}")
+
+
+def afficher_exports(df, cle):
+    manager = gestionnaire_exports()
+    if manager.progression(cle) >= 1.0:
+        _boutons_exports(df, cle)
+        return
+
+    if hasattr(st, "fragment"):
+        # Rafraîchit uniquement la zone d'export tant que des jobs tournent
+        @st.fragment(run_every=1)
+        def _zone_exports():
+            if manager.progression(cle) >= 1.0:
+                st.rerun()
+            st.progress(manager.progression(cle), text="Préparation des exports…")
+            _boutons_exports(df, cle)
+        _zone_exports()
+    else:
+        st.progress(manager.progression(cle), text="Préparation des exports…")
+        _boutons_exports(df, cle)
+        st.button("🔄 Actualiser les exports", key="refresh-exports")
+
+
+@st.cache_resource
+def bibliotheque_mesures():
+    # Bibliothèque commune aux projets de toutes les sessions du serveur
+    return BibliothequeMesures()
+
+
+def _reutiliser_mesure(activity, comp, milieu_name, att_key, sugg_key):
+    # Callback : exécuté avant le rerun, on peut donc réinitialiser le widget
+    impact = next(
+        (imp for imp in activity.impacts if imp.composante == comp and imp.milieu == milieu_name),
+        None
+    )
+    if impact is not None:
+        impact.attenuation = st.session_state[sugg_key]
+    st.session_state.pop(att_key, None)
+
+
+def afficher_recherche_mesures(activity, comp, milieu_name, att_key):
+    recherche = st.text_input(
+        "🔎 Réutiliser une mesure existante",
+        key=f"rech_{att_key}",
+        placeholder="Mots-clés (ex: arrosage pistes)"
+    )
+    if not recherche:
+        return
+    suggestions = bibliotheque_mesures().rechercher(recherche)
+    if not suggestions:
+        st.caption("Aucune mesure correspondante.")
+        return
+    sugg_key = f"sugg_{att_key}"
+    st.selectbox("Mesures suggérées", suggestions, key=sugg_key)
+    st.button(
+        "↩️ Réutiliser cette mesure",
+        key=f"reuse_{att_key}",
+        on_click=_reutiliser_mesure,
+        args=(activity, comp, milieu_name, att_key, sugg_key)
+    )
+
+
+@st.cache_resource(max_entries=64)
+def index_matrice(_df, version):
+    # `version` (signature du contenu) sert de clé : l'index n'est construit qu'une fois par version.
+    # cache_resource renvoie l'objet lui-même, sans copie : l'index est en lecture seule.
+    return construire_index(_df)
+
+
+def afficher_filtres(index):
+    ordres = {"Phase": PHASES, "Composante": COMPOSANTES, "Nature impact": NATURES, "Importance": IMPORTANCES}
+    selections = {}
+    with st.expander("🔎 Filtrer la matrice"):
+        cols = st.columns(len(COLONNES_FILTRABLES))
+        for col, (colonne, libelle) in zip(cols, COLONNES_FILTRABLES.items()):
+            valeurs = index[colonne]
+            options = [v for v in ordres[colonne] if v in valeurs] if colonne in ordres else sorted(valeurs)
+            with col:
+                selections[colonne] = st.multiselect(libelle, options, key=f"filtre_{colonne}")
+    return selections
+
+
 def main():
     st.set_page_config(page_title="Matrice d'Impact Environnemental", layout="wide")
     st.title("🌍 Générateur de Matrice d'Impact Environnemental par Phase")
@@ -225,13 +455,16 @@ def main():
         st.session_state.project = Project()
         st.session_state.collapsed = {}
         st.session_state.milieu_count = {}
+        st.session_state.historique = Historique()
+        st.session_state.id_session = uuid.uuid4().hex
         
     project = st.session_state.project
+    afficher_historique()
 
     # Gestion des phases
     selected_phases = st.multiselect(
         "Phases du projet",
-        ["Préconstruction", "Construction", "Exploitation/Entretien", "Démantèlement"],
+        PHASES,
         default=[p.name for p in project.phases]
     )
     
@@ -290,9 +523,10 @@ def main():
                 with col2:
                     st.markdown(f"**Activité:** {activity.name}")
                 with col3:
-                    if st.button("🗑️", key=f"del_act_{activity_key}"):
-                        phase.activities.remove(activity)
-                        _rerun()
+                    st.button(
+                        "🗑️", key=f"del_act_{activity_key}",
+                        on_click=_executer, args=(SuppressionActivite(phase.name, activity, COMPOSANTES),)
+                    )
                 
                 if not st.session_state.collapsed.get(activity_key, True):
                     st.markdown('</div>', unsafe_allow_html=True)
@@ -304,7 +538,7 @@ def main():
                     # Composantes environnementales
                     composantes = st.multiselect(
                         "Composantes environnementales concernées",
-                        ["Physique", "Biologique", "Humain"],
+                        COMPOSANTES,
                         key=f"comp_{phase.name}_{activity.name}",
                         help="Sélectionnez les composantes impactées par cette activité"
                     )
@@ -350,23 +584,16 @@ def main():
                                 with col2:
                                     st.write("")
                                     st.write("")
-                                    if st.button("🗑️", key=f"del_{milieu_key}"):
-                                        # Supprimer l'impact correspondant
-                                        activity.impacts = [imp for imp in activity.impacts 
-                                                          if not (imp.composante == comp and imp.milieu == milieu_name)]
-                                        _rerun()
+                                    # Supprimer l'impact correspondant (annulable)
+                                    st.button(
+                                        "🗑️", key=f"del_{milieu_key}", disabled=not milieu_name,
+                                        on_click=_executer,
+                                        args=(SuppressionMilieu(activity, comp, milieu_name, f"name_{milieu_key}"),)
+                                    )
                                 
                                 if not milieu_name:
                                     continue
                                 
-                                # Paramètres d'impact
-                                nature = st.selectbox(
-                                    "Nature de l'impact",
-                                    ["négatif", "positif", "risque impact"],
-                                    index=0,
-                                    key=f"nat_{milieu_key}"
-                                )
-                                
                                 # Vérifier s'il existe déjà un impact pour ce milieu
                                 existing_impact = next(
                                     (imp for imp in activity.impacts 
@@ -374,6 +601,14 @@ def main():
                                     None
                                 )
                                 
+                                # Paramètres d'impact (valeurs par défaut reprises de l'impact existant)
+                                nature = st.selectbox(
+                                    "Nature de l'impact",
+                                    NATURES,
+                                    index=_index_defaut(NATURES, existing_impact and existing_impact.nature, 0),
+                                    key=f"nat_{milieu_key}"
+                                )
+                                
                                 # Description de l'impact
                                 impact_apprehende = st.text_area(
                                     "Description de l'impact",
@@ -389,31 +624,33 @@ def main():
                                     with cols[0]:
                                         intensite = st.selectbox(
                                             "Intensité",
-                                            ["très forte", "forte", "moyenne", "faible"],
-                                            index=0,
+                                            INTENSITES,
+                                            index=_index_defaut(INTENSITES, existing_impact and existing_impact.intensite, 0),
                                             key=f"int_{milieu_key}"
                                         )
                                     with cols[1]:
                                         etendue = st.selectbox(
                                             "Étendue",
-                                            ["régionale", "locale", "ponctuelle"],
-                                            index=1,
+                                            ETENDUES,
+                                            index=_index_defaut(ETENDUES, existing_impact and existing_impact.etendue, 1),
                                             key=f"et_{milieu_key}"
                                         )
                                     with cols[2]:
                                         duree = st.selectbox(
                                             "Durée",
-                                            ["long terme", "moyen terme", "court terme"],
-                                            index=2,
+                                            DUREES,
+                                            index=_index_defaut(DUREES, existing_impact and existing_impact.duree, 2),
                                             key=f"dur_{milieu_key}"
                                     )
                                 
                                 if nature == 'négatif' or nature == 'risque impact':
                                     # use the stable loop index `i` in the key rather than the text itself
+                                    att_key = f"att_{phase.name}_{activity.name}_{comp}_{i}"
+                                    afficher_recherche_mesures(activity, comp, milieu_name, att_key)
                                     attenuation = st.text_area(
                                         "Mesures d'atténuation",
                                         value=existing_impact.attenuation if existing_impact else "",
-                                        key=f"att_{phase.name}_{activity.name}_{comp}_{i}",
+                                        key=att_key,
                                         height=100
                                     )                                        
                                 
@@ -437,23 +674,36 @@ def main():
             st.markdown('</div>', unsafe_allow_html=True)  # Fin section container
 
     # Affichage de la matrice finale
+    # L'instantané du projet remplace la contribution précédente de la session
+    bibliotheque_mesures().publier_projet(st.session_state.id_session, project)
     df = project.to_dataframe()
     if not df.empty:
         st.markdown("## 📊 Matrice des impacts environnementaux")
         st.markdown("### Synthèse complète des impacts par phase, activité et composante")
         
-        # Export CSV
-        csv = df.to_csv(index=False, sep=';').encode('utf-8')
-        st.download_button(
-            "💾 Exporter en CSV", 
-            csv, 
-            "matrice_impacts.csv", 
-            "text/csv",
-            key='download-csv'
-        )
+        # Exports construits en arrière-plan (CSV d'office, les autres à la demande)
+        version = signature(df)
+        manager = gestionnaire_exports()
+        manager.soumettre(df, cle=version)
+        zone_exports = st.container()
+        
+        # Filtres adossés aux index de la version courante
+        index = index_matrice(df, version)
+        selections = afficher_filtres(index)
+        df_filtre = filtrer(df, index, selections)
         
         # Affichage du tableau
-        st.markdown(tableau_html_fusion(df), unsafe_allow_html=True)
+        if df_filtre.empty:
+            st.info("ℹ️ Aucun impact ne correspond aux filtres sélectionnés.")
+        else:
+            tableau = tableau_html_fusion(df_filtre)
+            if df_filtre is df:
+                # Sans filtre, le tableau affiché est aussi l'export HTML : pas de second rendu
+                manager.deposer(version, "html", page_html(tableau))
+            st.markdown(tableau, unsafe_allow_html=True)
+        
+        with zone_exports:
+            afficher_exports(df, version)
     else:
         st.info("ℹ️ Commencez par ajouter des phases, activités et composantes pour générer la matrice.")
 
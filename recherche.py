@@ -0,0 +1,187 @@
+# recherche.py
+import heapq
+import re
+import threading
+import unicodedata
+from bisect import bisect_left
+from collections import Counter
+
+MOTS_VIDES = {
+    "a", "au", "aux", "avec", "ce", "ces", "dans", "de", "des", "du", "en", "et", "l", "la",
+    "le", "les", "d", "par", "pour", "sur", "un", "une", "ou", "qu", "que", "qui", "se",
+}
+
+_MOT = re.compile(r"[a-z0-9]+")
+
+# Les préfixes courts sont indexés directement : ils couvrent trop de mots pour être dépliés à la volée
+LONGUEUR_PREFIXE_INDEXE = 3
+
+
+def normaliser(texte):
+    """Minuscules sans accents : « Érosion » -> « erosion »."""
+    decompose = unicodedata.normalize("NFKD", texte.lower())
+    return "".join(c for c in decompose if not unicodedata.combining(c))
+
+
+def tokeniser(texte):
+    return [mot for mot in _MOT.findall(normaliser(texte)) if mot not in MOTS_VIDES]
+
+
+def _cles_index(mesure, description):
+    """Mots et préfixes courts sous lesquels une contribution (mesure, description) est indexée."""
+    cles = set()
+    for mot in set(tokeniser(mesure)) | set(tokeniser(description)):
+        cles.add(("mot", mot))
+        for n in range(1, min(len(mot), LONGUEUR_PREFIXE_INDEXE) + 1):
+            cles.add(("prefixe", mot[:n]))
+    return cles
+
+
+class BibliothequeMesures:
+    """Index inversé des mesures d'atténuation des projets en cours.
+
+    Chaque mesure distincte est un document indexé par ses propres mots et par
+    ceux des descriptions d'impact auxquelles elle est associée. Chaque source
+    (session/projet) publie un instantané de ses impacts qui remplace le
+    précédent : les saisies intermédiaires et les impacts supprimés sortent de
+    l'index, et l'usage d'une mesure est le nombre d'impacts qui l'emploient.
+    """
+
+    def __init__(self):
+        self._mesures = []          # id -> texte de la mesure (None si libéré)
+        self._ids = {}              # texte -> id
+        self._libres = []           # ids libérés, réutilisables
+        self._usages = []           # id -> nombre d'impacts utilisant la mesure
+        self._references = []       # id -> Counter des clés d'index référencées par ses contributions
+        self._postings = {}         # mot -> set(ids)
+        self._prefixes = {}         # préfixe court -> set(ids)
+        self._vocabulaire = []      # mots triés, pour la recherche par préfixe
+        self._vocabulaire_a_jour = True
+        self._sources = {}          # source -> Counter((mesure, description))
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._ids)
+
+    def _id(self, mesure):
+        id_mesure = self._ids.get(mesure)
+        if id_mesure is not None:
+            return id_mesure
+        if self._libres:
+            id_mesure = self._libres.pop()
+            self._mesures[id_mesure] = mesure
+            self._usages[id_mesure] = 0
+            self._references[id_mesure] = Counter()
+        else:
+            id_mesure = len(self._mesures)
+            self._mesures.append(mesure)
+            self._usages.append(0)
+            self._references.append(Counter())
+        self._ids[mesure] = id_mesure
+        return id_mesure
+
+    def _referencer(self, id_mesure, mesure, description, sens):
+        """Ajoute (sens=1) ou retire (sens=-1) les clés d'index d'une paire (mesure, description)."""
+        references = self._references[id_mesure]
+        for cle in _cles_index(mesure, description):
+            avant = references[cle]
+            references[cle] = avant + sens
+            genre, terme = cle
+            table = self._postings if genre == "mot" else self._prefixes
+            if sens > 0 and not avant:
+                if terme not in table:
+                    table[terme] = set()
+                    if genre == "mot":
+                        self._vocabulaire_a_jour = False
+                table[terme].add(id_mesure)
+            elif sens < 0 and avant == 1:
+                del references[cle]
+                table[terme].discard(id_mesure)
+                if not table[terme]:
+                    del table[terme]
+                    if genre == "mot":
+                        self._vocabulaire_a_jour = False
+
+    def publier(self, source, impacts):
+        """Remplace l'instantané de `source` par ses impacts actuels (objets Impact)."""
+        instantane = Counter(
+            (impact.attenuation.strip(), impact.impact_apprehende or "")
+            for impact in impacts
+            if impact.attenuation and impact.attenuation.strip()
+        )
+        with self._lock:
+            precedent = self._sources.get(source, Counter())
+            if instantane == precedent:
+                return
+            # Seules les paires dont le nombre d'impacts a changé sont réindexées
+            for paire in precedent.keys() | instantane.keys():
+                avant, apres = precedent[paire], instantane[paire]
+                if avant == apres:
+                    continue
+                mesure, description = paire
+                id_mesure = self._id(mesure)
+                self._usages[id_mesure] += apres - avant
+                if not avant:
+                    self._referencer(id_mesure, mesure, description, 1)
+                elif not apres:
+                    self._referencer(id_mesure, mesure, description, -1)
+                if self._usages[id_mesure] <= 0:
+                    del self._ids[mesure]
+                    self._mesures[id_mesure] = None
+                    self._references[id_mesure] = None
+                    self._libres.append(id_mesure)
+            if instantane:
+                self._sources[source] = instantane
+            else:
+                self._sources.pop(source, None)
+
+    def publier_projet(self, source, project):
+        self.publier(source, (
+            impact
+            for phase in project.phases
+            for activity in phase.activities
+            for impact in activity.impacts
+        ))
+
+    def retirer_source(self, source):
+        self.publier(source, ())
+
+    def _mots_prefixe(self, prefixe):
+        if not self._vocabulaire_a_jour:
+            self._vocabulaire = sorted(self._postings)
+            self._vocabulaire_a_jour = True
+        debut = bisect_left(self._vocabulaire, prefixe)
+        for mot in self._vocabulaire[debut:]:
+            if not mot.startswith(prefixe):
+                break
+            yield mot
+
+    def rechercher(self, requete, limite=10):
+        """Mesures contenant tous les mots de la requête, le dernier pouvant être incomplet."""
+        mots = _MOT.findall(normaliser(requete))
+        if not mots:
+            return []
+        *complets, prefixe = mots
+        complets = [mot for mot in complets if mot not in MOTS_VIDES]
+        with self._lock:
+            listes = sorted((self._postings.get(mot, set()) for mot in complets), key=len)
+            candidats = set(listes[0]) if listes else None
+            for ids in listes[1:]:
+                candidats &= ids
+                if not candidats:
+                    return []
+
+            if len(prefixe) <= LONGUEUR_PREFIXE_INDEXE:
+                ids = self._prefixes.get(prefixe, set())
+                par_prefixe = set(ids) if candidats is None else candidats & ids
+            else:
+                par_prefixe = set()
+                for mot in self._mots_prefixe(prefixe):
+                    ids = self._postings[mot]
+                    par_prefixe.update(ids if candidats is None else candidats & ids)
+            if candidats is not None and prefixe in MOTS_VIDES:
+                # Mot vide en cours de frappe : on garde les candidats déjà trouvés
+                par_prefixe |= candidats
+
+            meilleurs = heapq.nlargest(limite, par_prefixe, key=self._usages.__getitem__)
+            return [self._mesures[i] for i in meilleurs]